@@ -3,17 +3,24 @@
 import os
 import sys
 import time
+import asyncio
 import argparse
-from litellm import completion
-from litellm.utils import trim_messages
-import keyring
 import logging
 import subprocess
-import getpass
+from functools import lru_cache
 
+# litellm, keyring and getpass are imported lazily inside main(): litellm
+# alone takes hundreds of ms to import, which fast paths like --help and
+# "No changes to commit." should not pay.
+
+
+# Keep the system message and preset prompts byte-identical across runs:
+# provider prompt caches match on exact prefixes, so the stable text goes
+# first and volatile content (the diff, the mimic examples) trails it.
+system_message = "You are a helpful assistant."
 
 prompts = {
-    "default": lambda: """
+    "default": """
 You are an expert software engineer.
 Review the provided diffs which are about to be committed to a git repo.
 Review the diffs carefully.
@@ -21,69 +28,150 @@ Generate a commit message for those changes.
 The commit message MUST use the imperative tense.
 Reply with JUST the commit message, without quotes, comments, questions, etc!
 """,
-    "refactoring": lambda: """
+    "refactoring": """
 Please provide a detailed git commit message that explains the refactoring changes described below.
 Please detail every major change as a separate bullet point.
 Reply with JUST the commit message, without quotes, comments, questions, etc!
 """,
-    "documentation": lambda: """
+    "documentation": """
 Please provide a git commit message that explains the documentation changes described below.
 Reply with JUST the commit message, without quotes, comments, questions, etc!
 """,
-    "mimic": lambda: f"""
+    "mimic": """
 Please provide a git commit message for the diffs provided below.
-Your message should closely mimic the style and structure of the following recent git commit messages in this repository:
-
-{get_last_commits()}
-
+Your message should closely mimic the style and structure of the recent git commit messages from this repository, which are provided after the diff.
 Reply with JUST the commit message, without quotes, comments, questions, etc!
 """,
 }
 
 
+# Output of "git log" resolved ahead of time by main(), so the "mimic"
+# prompt doesn't spawn a subprocess of its own.
+_git_log_output = None
+
+
+# Approximate context window in tokens for known models; at ~4 chars per
+# token this bounds how much diff is worth reading before trim_messages
+# would cut it anyway.
+model_context_tokens = {
+    "gpt-4o-mini": 128_000,
+    "gpt-4o": 128_000,
+    "gpt-3.5-turbo": 16_000,
+    "claude-3-5-sonnet-20241022": 200_000,
+}
+default_context_tokens = 128_000
+
+
+def _diff_char_limit(model):
+    """
+    Returns the maximum number of diff characters worth reading for a model.
+    """
+    return 4 * model_context_tokens.get(model, default_context_tokens)
+
+
+def _git(*args):
+    """
+    Runs a git command without a shell and returns its raw stdout bytes.
+    """
+    return subprocess.run(
+        ("git",) + args,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+    ).stdout
+
+
+async def _run(cmd):
+    """
+    Runs a command and returns its decoded stdout.
+    """
+    process = await asyncio.create_subprocess_exec(
+        *cmd,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.DEVNULL,
+    )
+    stdout, _ = await process.communicate()
+    return stdout.decode()
+
+
+async def _read_diff(char_limit):
+    """
+    Reads the staged diff in 64 KiB chunks, stopping once char_limit is
+    reached so a huge diff is never fully materialized in memory; git is
+    terminated early and stops writing.
+    """
+    process = await asyncio.create_subprocess_exec(
+        "git",
+        "diff",
+        "--staged",
+        "--no-color",
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.DEVNULL,
+    )
+    chunks = []
+    total = 0
+    while total < char_limit:
+        chunk = await process.stdout.read(65536)
+        if not chunk:
+            break
+        chunks.append(chunk)
+        total += len(chunk)
+    if total >= char_limit:
+        process.terminate()
+        chunks.append(b"\n[diff truncated]\n")
+    await process.wait()
+    return b"".join(chunks).decode("utf-8", "replace")
+
+
+@lru_cache(maxsize=1)
 def get_last_commits(num_commits=5):
     """
     Returns the commit messages of the last num_commits commits.
+    Cached so repeated accesses don't re-run git log.
     """
-    try:
-        commit_messages = (
-            subprocess.check_output(
-                ["git", "log", "-n", str(num_commits), "--pretty=format:%B"],
-                stderr=subprocess.DEVNULL,
-            )
-            .decode()
-            .split("\n\n")
-        )  # decode and split the output into a list of commit messages
-
-        # Prefix each commit message with "Example <N> - "
-        commit_messages = [
-            f"Example {i+1} - {msg}" for i, msg in enumerate(commit_messages)
-        ]
-
-        # Join the commit messages back together with double newlines
-        commit_messages = "\n\n".join(commit_messages)
-
-        return f"Recent commits:\n{commit_messages}\n\n"
-    except subprocess.CalledProcessError:
+    if _git_log_output is not None:
+        raw_log = _git_log_output
+    else:
+        raw_log = _git(
+            "log", "-n", str(num_commits), "--pretty=format:%B"
+        ).decode("utf-8", "replace")
+
+    if not raw_log:
         return ""
 
+    # Split the output into a list of commit messages
+    commit_messages = raw_log.split("\n\n")
+
+    # Prefix each commit message with "Example <N> - "
+    commit_messages = [
+        f"Example {i+1} - {msg}" for i, msg in enumerate(commit_messages)
+    ]
+
+    # Join the commit messages back together with double newlines
+    commit_messages = "\n\n".join(commit_messages)
+
+    return f"Recent commits:\n{commit_messages}\n\n"
+
+
+# Model-name prefixes mapped to providers; adding a provider is one entry.
+_provider_prefixes = (
+    ("ollama/", "ollama"),
+    ("claude", "anthropic"),
+    ("gpt", "openai"),
+)
+
 
 def get_provider(model):
     """
     Returns the provider of the model.
     """
-    if model.startswith("gpt"):
-        return "openai"
-    elif model.startswith("claude"):
-        return "anthropic"
-    elif model.startswith("ollama/"):
-        return "ollama"
-    else:
-        print(f"Invalid model: {model}")
-        sys.exit(1)
+    for prefix, provider in _provider_prefixes:
+        if model.startswith(prefix):
+            return provider
+    print(f"Invalid model: {model}")
+    sys.exit(1)
 
 
-def main():
+async def _async_main():
     parser = argparse.ArgumentParser()
     parser.add_argument(
         "-p",
@@ -113,13 +201,28 @@ def main():
     if args.debug:
         logging.basicConfig(level=logging.DEBUG)
 
+    # Kick off the git subprocesses right away so they run concurrently
+    # with each other and with the API key lookup below.
+    diff_task = asyncio.create_task(_read_diff(_diff_char_limit(args.model)))
+    log_task = None
+    if args.prompt == "mimic":
+        log_task = asyncio.create_task(
+            _run(["git", "log", "-n", "5", "--pretty=format:%B"])
+        )
+
     provider = get_provider(args.model)
 
+    api_key = None
     if provider != "ollama":
         # Get the API key from the environment variables or keyring.
         env_var = "OPENAI_API_KEY" if provider == "openai" else "ANTHROPIC_API_KEY"
         api_key = os.getenv(env_var)
         if api_key is None:
+            # Importing keyring triggers backend discovery (DBus/Keychain),
+            # so only pay for it when the env var is unset.
+            import keyring
+            import getpass
+
             api_key = keyring.get_password("ai_commit_gen", f"{provider}_key")
             if api_key is None:
                 store_in_keyring = input(
@@ -131,45 +234,75 @@ def main():
                 else:
                     print(f"No {provider.capitalize()} API key provided. Exiting.")
                     sys.exit(1)
-        # Remove any extra whitespace from the API key.
-        os.environ[env_var] = api_key.strip()
+        # Remove any extra whitespace from the API key. Passed straight to
+        # the completion call rather than via os.environ, so the secret is
+        # not inherited by the git commit subprocess.
+        api_key = api_key.strip()
 
     messages = [
-        {"role": "system", "content": "You are a helpful assistant."},
+        {"role": "system", "content": system_message},
     ]
 
-    git_diff = os.popen("git diff --staged --no-color").read()
+    global _git_log_output
+    if log_task is not None:
+        git_diff, _git_log_output = await asyncio.gather(diff_task, log_task)
+    else:
+        git_diff = await diff_task
 
     # if git_diff empty or None, exit.
     if not git_diff:
         print("No changes to commit.")
         sys.exit(0)
 
+    from litellm import acompletion
+    from litellm.utils import trim_messages
+
     if args.prompt in prompts:
-        prompt = prompts[args.prompt]()
+        prompt = prompts[args.prompt]
     else:
-        prompt = args.prompt or prompts["default"]()
-
-    user_message = f"""{prompt}
-
-Output of "git diff --staged":
-{git_diff}
-"""
-
-    messages.append({"role": "user", "content": user_message})
+        # Custom prompt strings form the stable prefix, just like presets,
+        # so repeated runs with the same prompt still hit the provider cache.
+        prompt = args.prompt or prompts["default"]
 
-    # Trim messages to fit within model's context length
-    messages = trim_messages(messages, args.model)
+    messages.append({"role": "user", "content": prompt})
+    messages.append(
+        {"role": "user", "content": f'Output of "git diff --staged":\n{git_diff}'}
+    )
+    if args.prompt == "mimic":
+        # Commit examples change with history, so they go after the diff to
+        # keep the cacheable prefix stable across commits.
+        messages.append({"role": "user", "content": get_last_commits()})
+
+    # Trim messages to fit within model's context length. Tokenizing is the
+    # biggest non-network CPU cost here, so skip it when the prompt is
+    # comfortably inside the context window (under ~3 chars per token for a
+    # known model). Unknown models always go through trim_messages.
+    total_chars = sum(len(message["content"]) for message in messages)
+    safe_chars = 3 * model_context_tokens.get(args.model, 0)
+    if total_chars >= safe_chars:
+        messages = trim_messages(messages, args.model)
 
     # Note the start time.
     start_time = time.time()
 
     try:
-        response = completion(
+        stream = await acompletion(
             model=args.model,
             messages=messages,
+            stream=True,
+            api_key=api_key,
             api_base=args.apibase if args.apibase else ("http://localhost:11434" if provider == "ollama" else None)
         )
+
+        # Stream chunks to stdout as they arrive so the user sees output
+        # immediately; when committing, just accumulate into the buffer.
+        parts = []
+        async for chunk in stream:
+            delta = chunk.choices[0].delta.content or ""
+            parts.append(delta)
+            if not args.commit:
+                sys.stdout.write(delta)
+                sys.stdout.flush()
     except Exception as e:
         logging.debug(f"Error calling LiteLLM API: {e}")
         sys.exit(1)
@@ -179,14 +312,23 @@ Output of "git diff --staged":
     # Log the time taken for the query.
     logging.debug(f"Query took {end_time - start_time:.2f} seconds")
 
-    response_content = response.choices[0].message.content
+    response_content = "".join(parts)
 
-    # If the commit flag was passed, make the commit.
+    # If the commit flag was passed, make the commit. The message is piped
+    # via stdin so its formatting is preserved exactly.
     if args.commit:
-        commit_message = [("-m " + p) for p in response_content.split("\n\n")]
-        subprocess.run(["git", "commit"] + commit_message, check=True)
+        subprocess.run(
+            ["git", "commit", "-F", "-"],
+            input=response_content.encode("utf-8"),
+            check=True,
+        )
     else:
-        print(response_content)
+        # Streamed output doesn't include a trailing newline.
+        sys.stdout.write("\n")
+
+
+def main():
+    asyncio.run(_async_main())
 
 
 if __name__ == "__main__":